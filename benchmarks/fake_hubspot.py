@@ -0,0 +1,330 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import functools, random, threading, time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+
+SEARCH_RESULT_LIMIT = 10000
+
+
+@functools.lru_cache(maxsize=None)
+def get_timestamp(value):
+    return int(datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp() * 1000)
+
+
+def select_properties(record, properties=None):
+    # Like HubSpot, only the requested properties come back when a list is given.
+    if not properties:
+        return dict(record)
+    return {key: value for key, value in record.items() if key in properties or key == "hs_object_id"}
+
+
+class FakeApiException(Exception):
+    def __init__(self, status, reason, headers=None):
+        Exception.__init__(self, f"({status}) {reason}")
+        self.status = status
+        self.reason = reason
+        self.headers = headers or {}
+
+
+class FakeProperty(object):
+    def __init__(self, **kwargs):
+        self.data = kwargs
+
+    def to_dict(self):
+        return dict(self.data)
+
+
+def generate_properties(object_type, count=200):
+    properties = [
+        {"name": "hs_object_id", "type": "number", "field_type": "number", "options": []},
+        {"name": "createdate", "type": "datetime", "field_type": "date", "options": []},
+        {"name": "lastmodifieddate", "type": "datetime", "field_type": "date", "options": []},
+        {"name": "hubspot_owner_id", "type": "enumeration", "field_type": "select", "options": [], "referenced_object_type": "OWNER"},
+        {"name": "external_id", "type": "string", "field_type": "text", "options": []},
+        {"name": "name", "type": "string", "field_type": "text", "options": []},
+    ]
+    if object_type == "company":
+        properties.append(
+            {"name": "hs_parent_company_id", "type": "number", "field_type": "number", "options": [], "referenced_object_type": "COMPANY"}
+        )
+    kinds = ["string", "number", "datetime", "enumeration", "checkbox"]
+    for i in range(count - len(properties)):
+        kind = kinds[i % len(kinds)]
+        options = (
+            [{"value": f"v{j}", "label": f"Label {j}"} for j in range(8)]
+            if kind in ["enumeration", "checkbox"]
+            else []
+        )
+        properties.append(
+            {
+                "name": f"{object_type}_property_{i}",
+                "type": "enumeration" if kind == "checkbox" else kind,
+                "field_type": {"datetime": "date", "checkbox": "checkbox", "enumeration": "select"}.get(kind, "text"),
+                "options": options,
+            }
+        )
+    return properties
+
+
+def generate_value(property_setting, index):
+    if property_setting["type"] == "datetime":
+        return "2024-0{month}-1{day}T0{hour}:15:30{fraction}Z".format(
+            month=index % 9 + 1, day=index % 9, hour=index % 9, fraction=".250" if index % 2 else ""
+        )
+    if property_setting["type"] == "number":
+        return str(index % 1000)
+    if property_setting["field_type"] == "checkbox":
+        return f"v{index % 8};v{(index + 3) % 8}"
+    if len(property_setting["options"]) > 0:
+        return f"v{index % 8}"
+    return f"value {index}"
+
+
+class FakeHubspot(object):
+    def __init__(self, records=1000, latency=0.0, rate_limit=None, error_rate=0.0, properties=200, seed=0):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.window = []
+        self.properties = {
+            object_type: generate_properties(object_type, properties)
+            for object_type in ["contact", "company", "product"]
+        }
+        self.owners = [
+            SimpleNamespace(id=str(i), first_name=f"First{i}", last_name=f"Last{i}", email=f"owner{i}@example.com", archived=False)
+            for i in range(50)
+        ]
+        self.objects = {
+            object_type: [self.generate_object(object_type, i) for i in range(records)]
+            for object_type in ["contact", "company", "product"]
+        }
+        self.companies_by_id = {company["hs_object_id"]: company for company in self.objects["company"]}
+        self.hubspot = SimpleNamespace(
+            crm=SimpleNamespace(
+                contacts=self.get_crm_api("contact"),
+                companies=self.get_crm_api("company"),
+                products=self.get_crm_api("product"),
+                associations=SimpleNamespace(v4=SimpleNamespace(batch_api=SimpleNamespace(get_page=self.get_associations_page))),
+            ),
+            settings=SimpleNamespace(users=SimpleNamespace(teams_api=SimpleNamespace(get_all=self.get_teams))),
+            api_request=self.api_request,
+        )
+
+    def api_request(self, options):
+        self.request("api_request")
+        if options.get("path") != "/account-info/v3/details":
+            raise FakeApiException(404, "Not Found")
+        return SimpleNamespace(json=lambda: {"portalId": 12345})
+
+    def generate_object(self, object_type, index):
+        record = {
+            property_setting["name"]: generate_value(property_setting, index)
+            for property_setting in self.properties[object_type]
+        }
+        record.update(
+            {
+                "hs_object_id": str(index + 1),
+                "hubspot_owner_id": self.owners[index % len(self.owners)].id,
+                "external_id": f"{object_type}-{index}",
+                # A few records share each timestamp, like bulk imports do.
+                "lastmodifieddate": datetime.fromtimestamp(1704067200 + index // 3, tz=timezone.utc)
+                .isoformat()
+                .replace("+00:00", "Z"),
+            }
+        )
+        if object_type == "company":
+            record["hs_parent_company_id"] = str(index % 100 + 1)
+        return record
+
+    def request(self, name):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            now = time.monotonic()
+            self.window = [called_at for called_at in self.window if called_at > now - 10]
+            limited = self.rate_limit is not None and len(self.window) >= self.rate_limit
+            if not limited:
+                self.window.append(now)
+            injected = self.random.random() < self.error_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if limited or injected:
+            raise FakeApiException(429, "Too Many Requests", {"Retry-After": "0.01"})
+
+    def api_calls(self):
+        with self.lock:
+            return sum(self.calls.values())
+
+    def get_crm_api(self, object_type):
+        def do_search(public_object_search_request):
+            self.request(f"{object_type}.search")
+            after = int(public_object_search_request.get("after") or 0)
+            limit = public_object_search_request.get("limit", 100)
+            objects = self.objects.get(object_type, [])
+            if after + limit > SEARCH_RESULT_LIMIT:
+                raise FakeApiException(400, f"Search results are capped at {SEARCH_RESULT_LIMIT}.")
+            for filter_group in public_object_search_request.get("filterGroups", []):
+                for search_filter in filter_group["filters"]:
+                    if search_filter["operator"] == "IN":
+                        objects = [
+                            record
+                            for record in objects
+                            if record.get(search_filter["propertyName"]) in search_filter["values"]
+                        ]
+                    elif search_filter["operator"] in ["GTE", "LT"]:
+                        value = int(search_filter["value"])
+                        objects = [
+                            record
+                            for record in objects
+                            if (get_timestamp(record.get(search_filter["propertyName"])) >= value)
+                            == (search_filter["operator"] == "GTE")
+                        ]
+            for sort in public_object_search_request.get("sorts", []):
+                objects = sorted(
+                    objects,
+                    key=lambda record: (get_timestamp(record.get(sort["propertyName"])), int(record["hs_object_id"])),
+                    reverse=sort.get("direction") == "DESCENDING",
+                )
+            results = [
+                SimpleNamespace(id=record["hs_object_id"], properties=dict(record))
+                for record in objects[after : after + limit]
+            ]
+            next_after = str(after + limit) if after + limit < len(objects) else None
+            return SimpleNamespace(
+                results=results,
+                paging=SimpleNamespace(next=SimpleNamespace(after=next_after)) if next_after else None,
+            )
+
+        def upsert(batch_input_simple_public_object_batch_input_upsert):
+            self.request(f"{object_type}.batch_upsert")
+            return SimpleNamespace(
+                results=[
+                    SimpleNamespace(
+                        id=str(abs(hash(item["id"])) % 10**9),
+                        properties={item["idProperty"]: item["id"]},
+                    )
+                    for item in batch_input_simple_public_object_batch_input_upsert["inputs"]
+                ],
+                errors=[],
+            )
+
+        def create(batch_input_simple_public_object_input_for_create):
+            self.request(f"{object_type}.batch_create")
+            return SimpleNamespace(
+                results=[
+                    SimpleNamespace(id=str(abs(hash(str(item["properties"]))) % 10**9), properties=dict(item["properties"]))
+                    for item in batch_input_simple_public_object_input_for_create["inputs"]
+                ],
+                errors=[],
+            )
+
+        def update(batch_input_simple_public_object_batch_input):
+            self.request(f"{object_type}.batch_update")
+            return SimpleNamespace(
+                results=[
+                    SimpleNamespace(id=item["id"], properties=dict(item["properties"]))
+                    for item in batch_input_simple_public_object_batch_input["inputs"]
+                ],
+                errors=[],
+            )
+
+        def read(batch_read_input_simple_public_object_id):
+            self.request(f"{object_type}.batch_read")
+            objects = {record["hs_object_id"]: record for record in self.objects.get(object_type, [])}
+            return SimpleNamespace(
+                results=[
+                    SimpleNamespace(
+                        id=item["id"],
+                        properties=select_properties(
+                            objects[item["id"]], batch_read_input_simple_public_object_id.get("properties")
+                        ),
+                    )
+                    for item in batch_read_input_simple_public_object_id["inputs"]
+                    if item["id"] in objects
+                ]
+            )
+
+        return SimpleNamespace(
+            search_api=SimpleNamespace(do_search=do_search),
+            batch_api=SimpleNamespace(upsert=upsert, read=read, create=create, update=update),
+        )
+
+    def get_associations_page(self, from_object_type, to_object_type, batch_input_public_fetch_associations_batch_request):
+        self.request("associations.batch_read")
+        return SimpleNamespace(
+            results=[
+                SimpleNamespace(
+                    _from=SimpleNamespace(id=item["id"]),
+                    to=[
+                        SimpleNamespace(
+                            to_object_id=str(int(item["id"]) % 100 + 1),
+                            association_types=[SimpleNamespace(type_id=1, label="Primary")],
+                        )
+                    ],
+                )
+                for item in batch_input_public_fetch_associations_batch_request["inputs"]
+            ]
+        )
+
+    def get_teams(self):
+        self.request("teams")
+        return SimpleNamespace(results=[SimpleNamespace(id=str(i), name=f"Team {i}") for i in range(5)])
+
+
+class FakeHubspotConnector(object):
+    def __init__(self, hubspot):
+        self.fake = hubspot
+        self.hubspot = hubspot.hubspot
+
+    def get_properties_by_object_type(self, object_type, properties=None):
+        self.fake.request("properties")
+        return SimpleNamespace(results=[FakeProperty(**data) for data in self.fake.properties[object_type]])
+
+    def get_all_owners(self):
+        self.fake.request("owners")
+        return [SimpleNamespace(to_dict=lambda owner=owner: dict(vars(owner)), **vars(owner)) for owner in self.fake.owners]
+
+    def get_contact_primary_company_id(self, contact_id):
+        self.fake.request("contact.primary_company")
+        return str(int(contact_id) % 100 + 1)
+
+    def get_company(self, company_id, properties=None):
+        self.fake.request("company.get")
+        company = self.fake.companies_by_id.get(str(company_id))
+        return SimpleNamespace(id=str(company_id), properties=select_properties(company, properties)) if company else None
+
+    def get_companies(self, **params):
+        self.fake.request("company.search")
+        ids = params["filter_groups"][0]["filters"][0]["values"]
+        return [
+            SimpleNamespace(
+                id=company_id,
+                properties=select_properties(self.fake.companies_by_id[company_id], params.get("properties")),
+            )
+            for company_id in ids
+            if company_id in self.fake.companies_by_id
+        ]
+
+    def insert_update_contact(self, data, id_property=None):
+        self.fake.request("contact.upsert")
+        return str(abs(hash(data.get(id_property))) % 10**9)
+
+    def insert_update_company(self, data, id_property=None):
+        self.fake.request("company.upsert")
+        return str(abs(hash(data.get(id_property))) % 10**9)
+
+    def insert_update_product(self, data, id_property=None):
+        self.fake.request("product.upsert")
+        return str(abs(hash(data.get(id_property))) % 10**9)
+
+    def upload_file_by_url(self, **file_data):
+        self.fake.request("file.upload")
+        return str(abs(hash(file_data.get("url"))) % 10**9)
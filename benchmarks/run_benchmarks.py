@@ -0,0 +1,263 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import argparse, copy, json, logging, os, subprocess, sys, time, tracemalloc
+from datetime import datetime
+from pytz import timezone, utc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datawald_hubspotagency import HubspotAgent
+from fake_hubspot import FakeHubspot, FakeHubspotConnector
+
+RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results.jsonl")
+SRC_METADATA = {
+    "src_id": "hs_object_id",
+    "created_at": "createdate",
+    "updated_at": "lastmodifieddate",
+}
+
+
+def get_agent(fake, **setting):
+    setting = dict(
+        {
+            "portal_id": f"benchmark-{id(fake)}",
+            "state_store": {"backend": "memory"},
+            "src_metadata": {"datawald": {"contact": SRC_METADATA, "company": SRC_METADATA}},
+            "TXMAP": {"datawald": {}},
+            "id_property": {"contact": "external_id", "company": "external_id", "product": "external_id"},
+            "convert_timezone_settings": {"pst": "America/Los_Angeles", "cet": "Europe/Paris"},
+        },
+        **setting
+    )
+    agent = HubspotAgent(logging.getLogger("benchmark"), **setting)
+    agent.hubspot_connector.connector = FakeHubspotConnector(fake)
+    agent.transform_data = lambda raw_entity, tx_map: raw_entity
+    return agent
+
+
+def run_source(agent, tx_type):
+    count = 0
+    for entities, _ in agent.tx_entities_src_stream(target="datawald", tx_type=tx_type):
+        count += len(entities)
+    return count
+
+
+def run_target(agent, tx_type, records):
+    persons = [
+        agent.tx_person_tgt(
+            {"tx_type_src_id": f"{tx_type}-{record['external_id']}", "data": dict(record)}
+        )
+        for record in records
+    ]
+    agent.insert_update_persons(persons)
+    return len([person for person in persons if person.get("tx_status") == "S"])
+
+
+def run_assets(agent, tx_type, records):
+    # Half of the records already exist in the fake portal, the other half are new.
+    assets = [
+        agent.tx_asset_tgt(
+            {
+                "tx_type_src_id": f"{tx_type}-{i}",
+                "data": dict(record, external_id=record["external_id"] if i % 2 else f"new-{i}"),
+            }
+        )
+        for i, record in enumerate(records)
+    ]
+    agent.insert_update_assets(assets)
+    return len([asset for asset in assets if asset.get("tx_status") == "S"])
+
+
+def process_properties_per_record(agent, object_type, properties_data):
+    # The per-record loop the compiled properties plan replaced, kept for comparison.
+    process_properties = agent.get_properties_can_be_processed(object_type)
+    convert_timezone = agent.setting.get("convert_timezone_settings", {})
+    for property_name, property_setting in process_properties.items():
+        if property_name in properties_data:
+            new_value = agent.format_property_value(property_setting=property_setting, value=properties_data.get(property_name))
+            if property_name.find("_id") != -1:
+                properties_data[property_name.replace("_id", "")] = new_value
+            if len(convert_timezone) > 0 and property_setting.get("type") == "datetime" and properties_data.get(property_name):
+                value = properties_data.get(property_name)
+                value_format = "%Y-%m-%dT%H:%M:%S.%fZ" if value.find(".") != -1 else "%Y-%m-%dT%H:%M:%SZ"
+                for suffix, timezone_name in convert_timezone.items():
+                    properties_data[f"{property_name}_{suffix}"] = (
+                        datetime.strptime(value, value_format)
+                        .replace(tzinfo=utc)
+                        .astimezone(timezone(timezone_name))
+                        .strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+                    )
+                if value.find(".") == -1:
+                    new_value = datetime.strptime(value, value_format).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+            properties_data[property_name] = new_value
+    return properties_data
+
+
+def run_properties(agent, object_type, records, compiled=True):
+    agent.get_properties_can_be_processed(object_type)
+    for record in records:
+        if compiled:
+            agent.process_hubspot_properties_values(object_type=object_type, properties_data=dict(record))
+        else:
+            process_properties_per_record(agent, object_type, dict(record))
+    return len(records)
+
+
+def get_wide_records(records, extra_fields=300):
+    # Source records carry many fields HubSpot has no property for, some of them nested.
+    return [
+        dict(
+            {key: value for key, value in record.items() if key != "hubspot_owner_id"},
+            **{
+                f"extra_{i}": {"values": [i, str(i)], "note": f"extra {i}"} if i % 3 == 0 else f"extra {i}"
+                for i in range(extra_fields)
+            },
+        )
+        for record in records
+    ]
+
+
+def project_by_deepcopy(agent, person):
+    # The deepcopy-then-pop projection tx_person_tgt used before it built the projected dict directly.
+    hubspot_properties = agent.get_properties_can_be_processed(object_type="contact")
+    new_person = copy.deepcopy(person)
+    for property_name in person["data"].keys():
+        if property_name not in hubspot_properties and property_name != "attachments":
+            new_person["data"].pop(property_name)
+    return new_person
+
+
+def run_projection(agent, records, deepcopy=False):
+    agent.get_properties_can_be_processed(object_type="contact")
+    persons = [{"tx_type_src_id": f"contact-{record['external_id']}", "data": record} for record in records]
+    for person in persons:
+        if deepcopy:
+            project_by_deepcopy(agent, person)
+        else:
+            agent.tx_person_tgt(person)
+    return len(persons)
+
+
+def measure(name, scale, fake, funct, trace_memory=False):
+    # tracemalloc slows the run down noticeably, so memory is only traced on request.
+    if trace_memory:
+        tracemalloc.start()
+    started_at = time.perf_counter()
+    records = funct()
+    elapsed = time.perf_counter() - started_at
+    peak_memory = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    if trace_memory:
+        tracemalloc.stop()
+    return {
+        "scenario": name,
+        "scale": scale,
+        "records": records,
+        "elapsed": round(elapsed, 3),
+        "records_per_second": round(records / elapsed, 2) if elapsed > 0 else None,
+        "api_calls": fake.api_calls(),
+        "api_calls_per_record": round(fake.api_calls() / records, 3) if records else None,
+        "calls": dict(fake.calls),
+        "peak_memory_mb": round(peak_memory / 1024 / 1024, 2) if trace_memory else None,
+    }
+
+
+def get_scenarios(args):
+    setting = {"max_workers": args.max_workers, "stream_batch_size": 500}
+    return {
+        "source_company": lambda fake: run_source(get_agent(fake, **setting), "company"),
+        "source_contact": lambda fake: run_source(get_agent(fake, **setting), "contact"),
+        "source_contact_graph": lambda fake: run_source(
+            get_agent(fake, associations={"contact": {"companies": ["name"]}}, **setting),
+            "contact",
+        ),
+        "target_contact": lambda fake: run_target(
+            get_agent(fake, **setting), "contact", fake.objects["contact"]
+        ),
+        "target_contact_batch": lambda fake: run_target(
+            get_agent(fake, batch_upsert=True, **setting), "contact", fake.objects["contact"]
+        ),
+        "target_product": lambda fake: run_assets(
+            get_agent(fake, **setting), "product", fake.objects["product"]
+        ),
+        "target_product_batch": lambda fake: run_assets(
+            get_agent(fake, batch_upsert=True, **setting), "product", fake.objects["product"]
+        ),
+        "target_projection": lambda fake: run_projection(
+            get_agent(fake, **setting), get_wide_records(fake.objects["contact"])
+        ),
+        "target_deepcopy": lambda fake: run_projection(
+            get_agent(fake, **setting), get_wide_records(fake.objects["contact"]), deepcopy=True
+        ),
+        "properties_plan": lambda fake: run_properties(
+            get_agent(fake, **setting), "company", fake.objects["company"]
+        ),
+        "properties_per_record": lambda fake: run_properties(
+            get_agent(fake, **setting), "company", fake.objects["company"], compiled=False
+        ),
+    }
+
+
+def get_version():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(RESULTS),
+            stderr=subprocess.DEVNULL,
+        ).decode("utf-8").strip()
+    except Exception:
+        return None
+
+
+def get_previous_results():
+    previous_results = {}
+    if os.path.exists(RESULTS):
+        with open(RESULTS) as f:
+            for line in f:
+                result = json.loads(line)
+                previous_results[(result["scenario"], result["scale"])] = result
+    return previous_results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks against a fake HubSpot API.")
+    parser.add_argument("--scales", default="1000,10000", help="Comma separated record counts, e.g. 1000,10000,100000.")
+    parser.add_argument("--scenarios", default=None, help="Comma separated scenarios, default all.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every fake API call.")
+    parser.add_argument("--rate-limit", type=int, default=None, help="Fake calls allowed per 10 seconds.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of calls answered with 429.")
+    parser.add_argument("--max-workers", type=int, default=1)
+    parser.add_argument("--memory", action="store_true", help="Trace peak memory with tracemalloc.")
+    parser.add_argument("--save", action="store_true", help=f"Append the results to {RESULTS}.")
+    args = parser.parse_args()
+
+    scenarios = get_scenarios(args)
+    names = args.scenarios.split(",") if args.scenarios else list(scenarios.keys())
+    previous_results = get_previous_results()
+    version = get_version()
+    for scale in [int(scale) for scale in args.scales.split(",")]:
+        for name in names:
+            fake = FakeHubspot(
+                records=scale,
+                latency=args.latency,
+                rate_limit=args.rate_limit,
+                error_rate=args.error_rate,
+            )
+            result = measure(name, scale, fake, lambda: scenarios[name](fake), trace_memory=args.memory)
+            result.update({"version": version, "max_workers": args.max_workers, "latency": args.latency})
+            previous = previous_results.get((name, scale))
+            if previous and previous.get("records_per_second") and result["records_per_second"]:
+                result["change"] = round(
+                    result["records_per_second"] / previous["records_per_second"] - 1, 3
+                )
+            print(json.dumps({key: value for key, value in result.items() if key != "calls"}))
+            if args.save:
+                with open(RESULTS, "a") as f:
+                    f.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
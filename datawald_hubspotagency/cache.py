@@ -0,0 +1,170 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import hashlib, pickle, sqlite3, threading, time
+from .metrics import Metrics
+
+
+class MemoryBackend(object):
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.time():
+                self.data.pop(key, None)
+                return None
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self.data[key] = (value, time.time() + ttl if ttl else None)
+
+    def incr(self, key, amount=1, ttl=None):
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is None or (entry[1] is not None and entry[1] < time.time()):
+                entry = (0, time.time() + ttl if ttl else None)
+            self.data[key] = (entry[0] + amount, entry[1])
+            return entry[0] + amount
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def delete_prefix(self, prefix):
+        with self.lock:
+            for key in [key for key in self.data.keys() if key.startswith(prefix)]:
+                self.data.pop(key, None)
+
+
+class SQLiteBackend(object):
+    def __init__(self, path="/tmp/datawald_hubspotagency.db"):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expires_at REAL)"
+            )
+
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        if row[1] is not None and row[1] < time.time():
+            self.delete(key)
+            return None
+        return pickle.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, pickle.dumps(value), time.time() + ttl if ttl else None),
+            )
+
+    def incr(self, key, amount=1, ttl=None):
+        # BEGIN IMMEDIATE serializes the read and the write across processes sharing the file.
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.connection.execute(
+                    "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None or (row[1] is not None and row[1] < time.time()):
+                    row = (pickle.dumps(0), time.time() + ttl if ttl else None)
+                value = pickle.loads(row[0]) + amount
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, pickle.dumps(value), row[1]),
+                )
+                self.connection.commit()
+            except Exception:
+                self.connection.rollback()
+                raise
+        return value
+
+    def delete(self, key):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def delete_prefix(self, prefix):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "DELETE FROM cache WHERE substr(key, 1, ?) = ?", (len(prefix), prefix)
+            )
+
+
+# Module level so warm containers keep the metadata between invocations.
+backends = {"memory": MemoryBackend()}
+backends_lock = threading.Lock()
+
+
+def get_backend(backend="memory", path=None):
+    if backend == "memory":
+        return backends["memory"]
+    if backend != "sqlite":
+        raise Exception(f"{backend} cache backend is not supported.")
+    with backends_lock:
+        key = f"sqlite:{path}"
+        if key not in backends:
+            backends[key] = SQLiteBackend(path) if path else SQLiteBackend()
+        return backends[key]
+
+
+def get_cache_namespace(setting, client=None):
+    if setting.get("portal_id"):
+        return str(setting["portal_id"])
+    # Without portal_id, key the metadata on the credential the HubSpot client was built with;
+    # sync state is never keyed on it (see HubspotAgency.get_portal_id).
+    credential = next(
+        (getattr(client, key) for key in ["access_token", "api_key"] if getattr(client, key, None)),
+        None,
+    )
+    if credential is None:
+        return None
+    return hashlib.sha256(str(credential).encode("utf-8")).hexdigest()[:16]
+
+
+class MetadataCache(object):
+    def __init__(self, namespace, backend="memory", path=None, ttl=3600, metrics=None):
+        self.namespace = namespace
+        self.backend = get_backend(backend=backend, path=path)
+        self.ttl = ttl
+        self.metrics = metrics if metrics is not None else Metrics()
+
+    def get_key(self, *parts):
+        return ":".join([self.namespace] + [str(part) for part in parts])
+
+    def get(self, *parts):
+        with self.metrics.timer(f"cache.{parts[0]}"):
+            value = self.backend.get(self.get_key(*parts))
+        self.metrics.increment(f"cache.{parts[0]}.{'miss' if value is None else 'hit'}")
+        return value
+
+    def set(self, value, *parts, ttl=None):
+        self.backend.set(self.get_key(*parts), value, ttl=ttl or self.ttl)
+        return value
+
+    def increment(self, amount, *parts, ttl=None):
+        return self.backend.incr(self.get_key(*parts), amount, ttl=ttl or self.ttl)
+
+    def invalidate(self, *parts):
+        if len(parts) == 0:
+            self.backend.delete_prefix(f"{self.namespace}:")
+        else:
+            key = self.get_key(*parts)
+            self.backend.delete(key)
+            self.backend.delete_prefix(f"{key}:")
@@ -4,28 +4,157 @@ from __future__ import print_function
 
 __author__ = "bibow"
 
-import traceback, pendulum, time, copy
+import traceback, pendulum, threading, time, hashlib, json, re, urllib.request, uuid
 from datawald_agency import Agency
 from datawald_connector import DatawaldConnector
 from hubspot_connector import HubspotConnector
 from datetime import datetime, timedelta
 from pytz import timezone,utc
 from decimal import Decimal
+from functools import lru_cache
+from types import SimpleNamespace
+from .cache import MetadataCache, get_cache_namespace
+from contextlib import contextmanager
+from .metrics import Metrics, profile, timed
+from .owners import OwnerIndex
+from .throttle import AdaptivePageSize, TokenBucket, ThrottledConnector, map_in_order
+
+BATCH_LIMIT = 100
+SEARCH_LIMIT = 200
+SEARCH_RESULT_LIMIT = 10000
+CRM_OBJECTS = {
+    "contact": "contacts",
+    "company": "companies",
+    "product": "products",
+    "deal": "deals",
+    "line_item": "line_items",
+}
+PRIMARY_COMPANY_ASSOCIATION_TYPE_ID = 1
+MAX_PROPERTIES_PLANS = 64
+DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+DATETIME_PATTERN = re.compile(
+    r"^([0-9]{4})-([0-9]{2})-([0-9]{2})T([0-9]{2}):([0-9]{2}):([0-9]{2})(?:\.([0-9]{1,6}))?Z\Z"
+)
+MAX_CONVERTED_DATETIMES = 100000
+
 
 class IgnoreException(Exception):
     pass
 
-class HubspotAgency(Agency):
-    all_owners = {}
-    hubspot_users = {}
-    hubspot_team_options = None
-    hubspot_properties = {}
-    properties_can_process = {}
 
+def get_sync_key(entity):
+    return "{src_id}:{updated_at}".format(
+        src_id=entity["src_id"], updated_at=entity["updated_at"].timestamp()
+    )
+
+
+def get_fingerprint(data):
+    return hashlib.sha256(
+        json.dumps(data, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def get_file_key(file_data):
+    return get_fingerprint(file_data)
+
+
+def get_file_version(url, timeout=10):
+    request = urllib.request.Request(url, method="HEAD")
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.headers.get("ETag") or response.headers.get("Last-Modified")
+
+
+def get_file_id(file_ids, file_data):
+    file_id = file_ids[get_file_key(file_data)]
+    if isinstance(file_id, Exception):
+        raise file_id
+    return file_id
+
+
+@lru_cache(maxsize=None)
+def get_timezone(timezone_name):
+    return timezone(timezone_name)
+
+
+def parse_hubspot_datetime(value):
+    matched = DATETIME_PATTERN.match(value)
+    if matched is None:
+        if value.find(".") != -1:
+            return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%fZ")
+        return datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ")
+    year, month, day, hour, minute, second, fraction = matched.groups()
+    return datetime(
+        int(year),
+        int(month),
+        int(day),
+        int(hour),
+        int(minute),
+        int(second),
+        int(fraction.ljust(6, "0")) if fraction else 0,
+    )
+
+
+def convert_datetime(value, timezones):
+    # Returns the normalized value for timestamps without fraction (None otherwise) and the converted values.
+    naive_value = parse_hubspot_datetime(value)
+    utc_value = naive_value.replace(tzinfo=utc)
+    return (
+        naive_value.strftime(DATETIME_FORMAT) if value.find(".") == -1 else None,
+        [
+            (suffix, utc_value.astimezone(tzinfo).strftime(DATETIME_FORMAT))
+            for suffix, tzinfo in timezones
+        ],
+    )
+
+
+def to_hubspot_timestamp(value):
+    if isinstance(value, str):
+        value = pendulum.parse(value)
+    return str(int(value.timestamp() * 1000))
+
+
+class HubspotAgency(Agency):
     def __init__(self, logger, **setting):
         self.logger = logger
         self.setting = setting
-        self.hubspot_connector = HubspotConnector(logger, setting)
+        self.metrics = Metrics(enabled=bool(setting.get("instrumentation", False)))
+        rate_limit = setting.get("rate_limit")
+        self.hubspot_connector = ThrottledConnector(
+            logger,
+            HubspotConnector(logger, setting),
+            token_bucket=TokenBucket(daily_counter=self.count_daily_api_calls, **rate_limit)
+            if rate_limit
+            else None,
+            max_retries=int(setting.get("max_retries", 3)),
+            metrics=self.metrics,
+        )
+        # An agency that cannot tell its portal keeps the metadata to itself.
+        self.namespace = get_cache_namespace(
+            setting, client=getattr(self.hubspot_connector.connector, "hubspot", None)
+        ) or f"agency-{uuid.uuid4().hex}"
+        self.metadata_cache = MetadataCache(
+            self.namespace,
+            metrics=self.metrics,
+            **setting.get("metadata_cache", {})
+        )
+        self.hubspot_team_options = None
+        self.hubspot_properties = {}
+        self.properties_can_process = {}
+        self.properties_plans = {}
+        self.target_properties = {}
+        self.converted_datetimes = {}
+        self.page_sizes = {}
+        self.page_sizes_lock = threading.Lock()
+        self.owner_index = OwnerIndex(
+            logger,
+            self.load_hubspot_users,
+            ttl=setting.get("owner_refresh_ttl", self.metadata_cache.ttl),
+        )
+        self._state_store = None
+        self.state_store_lock = threading.Lock()
+        self.stream_entities = None
+        self.synced_entities = []
+        self.max_workers = int(setting.get("max_workers", 1))
         self.datawald = DatawaldConnector(logger, **setting)
         Agency.__init__(self, logger, datawald=self.datawald)
         if setting.get("tx_type"):
@@ -33,11 +162,290 @@ class HubspotAgency(Agency):
 
         self.map = setting.get("TXMAP", {})
 
+    @property
+    def state_store(self):
+        # Opened by the stateful features only, under its own prefix so metadata invalidation never reaches it.
+        if self._state_store is None:
+            with self.state_store_lock:
+                if self._state_store is None:
+                    self._state_store = MetadataCache(
+                        f"state:{self.get_portal_id()}",
+                        metrics=self.metrics,
+                        **dict({"backend": "sqlite", "ttl": None}, **self.setting.get("state_store", {}))
+                    )
+        return self._state_store
+
+    def get_portal_id(self):
+        if self.setting.get("portal_id"):
+            return str(self.setting["portal_id"])
+        # Sync state outlives token rotation, so it is keyed on the portal the token belongs to.
+        # The call skips the throttle, whose daily counter lives in the state store being opened.
+        try:
+            response = self.hubspot_connector.connector.hubspot.api_request(
+                {"method": "GET", "path": "/account-info/v3/details"}
+            )
+            return str(response.json()["portalId"])
+        except Exception:
+            log = traceback.format_exc()
+            self.logger.exception(log)
+            raise Exception(f"portal_id is required to keep the HubSpot sync state: {log}")
+
+    def count_daily_api_calls(self, day, amount):
+        # Agencies sharing the state store file share the quota; with the default /tmp SQLite path
+        # that is the invocations of one container.
+        return self.state_store.increment(amount, "daily_api_calls", day, ttl=2 * 86400)
+
+    def retrieve_entities_from_source(self, **params):
+        with self.instrument_run("retrieve_entities_from_source", **params):
+            if self.get_incremental_sync() is not None and not params.get("full_sync"):
+                params = self.apply_high_water_mark(**params)
+            if not self.setting.get("stream_batch_size"):
+                self.synced_entities = []
+                result = Agency.retrieve_entities_from_source(self, **params)
+                self.save_high_water_mark(**params)
+                return result
+            # Hand each batch to the regular pipeline through tx_persons_src/tx_transactions_src.
+            result = None
+            for entities, after in self.tx_entities_src_stream(**params):
+                self.stream_entities = entities
+                self.synced_entities = []
+                try:
+                    result = Agency.retrieve_entities_from_source(self, **params)
+                finally:
+                    self.stream_entities = None
+                self.save_checkpoint(after, **params)
+                self.save_high_water_mark(**params)
+            return result
+
+    def insert_update_entities_to_target(self, **params):
+        with self.instrument_run("insert_update_entities_to_target", **params):
+            return Agency.insert_update_entities_to_target(self, **params)
+
+    @contextmanager
+    def instrument_run(self, name, **params):
+        self.metrics.reset()
+        try:
+            with profile(self.logger, self.setting.get("profiler")):
+                yield
+        finally:
+            if self.metrics.enabled:
+                summary = self.metrics.summary()
+                summary.update(
+                    {
+                        "run": name,
+                        "tx_type": params.get("tx_type"),
+                    }
+                )
+                self.logger.info(json.dumps(summary, default=str))
+
+    @timed("transform_data")
+    def transform_data(self, *args, **kwargs):
+        return Agency.transform_data(self, *args, **kwargs)
+
     def tx_transactions_src(self, **kwargs):
-        return self.tx_entities_src(**kwargs)
+        if self.stream_entities is not None:
+            return self.filter_synced_entities(self.stream_entities, **kwargs)
+        return self.filter_synced_entities(self.tx_entities_src(**kwargs), **kwargs)
 
     def tx_persons_src(self, **kwargs):
-        return self.tx_entities_src(**kwargs)
+        if self.stream_entities is not None:
+            return self.filter_synced_entities(self.stream_entities, **kwargs)
+        # Contacts and companies are read by page so tx_persons_src_ext can enrich a page at a time.
+        return self.filter_synced_entities(
+            [entity for entities, _ in self.tx_entities_src_pages(**kwargs) for entity in entities],
+            **kwargs
+        )
+
+    def get_incremental_sync(self):
+        # incremental_sync: true, or {"overlap_seconds": 300}; unset or false turns it off.
+        incremental_sync = self.setting.get("incremental_sync")
+        if incremental_sync is None or incremental_sync is False:
+            return None
+        return incremental_sync if isinstance(incremental_sync, dict) else {}
+
+    def get_high_water_mark(self, **kwargs):
+        return self.state_store.get("high_water_mark", kwargs.get("target"), kwargs.get("tx_type"))
+
+    def apply_high_water_mark(self, **params):
+        high_water_mark = self.get_high_water_mark(**params)
+        if high_water_mark is None:
+            return params
+        overlap = float(self.get_incremental_sync().get("overlap_seconds", 300))
+        cut_date = datetime.fromtimestamp(high_water_mark["updated_at"] - overlap, tz=utc)
+        self.logger.info(f"Sync {params.get('tx_type')} incrementally from {cut_date.isoformat()}.")
+        return dict(params, cut_date=cut_date.isoformat())
+
+    def filter_synced_entities(self, entities, **kwargs):
+        self.metrics.increment("records", len(entities))
+        if self.get_incremental_sync() is None or kwargs.get("full_sync"):
+            return entities
+        # Records in the overlap window that were already synced keep the same src_id + updated_at.
+        high_water_mark = self.get_high_water_mark(**kwargs) or {"keys": {}}
+        entities = [
+            entity
+            for entity in entities
+            if get_sync_key(entity) not in high_water_mark["keys"]
+        ]
+        self.synced_entities.extend(
+            [(get_sync_key(entity), entity["updated_at"].timestamp()) for entity in entities]
+        )
+        return entities
+
+    def save_high_water_mark(self, **kwargs):
+        if self.get_incremental_sync() is None or len(self.synced_entities) == 0:
+            return
+        high_water_mark = self.get_high_water_mark(**kwargs) or {"updated_at": 0, "keys": {}}
+        keys = dict(high_water_mark["keys"], **dict(self.synced_entities))
+        updated_at = max([high_water_mark["updated_at"]] + list(keys.values()))
+        overlap = float(self.get_incremental_sync().get("overlap_seconds", 300))
+        self.state_store.set(
+            {
+                "updated_at": updated_at,
+                "keys": {
+                    key: timestamp
+                    for key, timestamp in keys.items()
+                    if timestamp >= updated_at - overlap
+                },
+            },
+            "high_water_mark",
+            kwargs.get("target"),
+            kwargs.get("tx_type"),
+        )
+        self.synced_entities = []
+
+    def tx_entities_src_stream(self, **kwargs):
+        batch_size = int(self.setting.get("stream_batch_size", BATCH_LIMIT))
+        after = self.get_checkpoint(**kwargs)
+        entities = []
+        for page_entities, next_after in self.tx_entities_src_pages(
+            after=after, limit=min(batch_size, SEARCH_LIMIT), **kwargs
+        ):
+            # Batches end on page boundaries so the checkpoint cursor never splits a page.
+            if len(entities) > 0 and len(entities) + len(page_entities) > batch_size:
+                yield entities, after
+                entities = []
+            entities.extend(page_entities)
+            after = next_after
+        if len(entities) > 0:
+            yield entities, after
+
+    def tx_entities_src_pages(self, after=None, limit=SEARCH_LIMIT, **kwargs):
+        hs_type = self.get_hs_type(kwargs.get("tx_type"))
+        entity_type = "person" if hs_type in ["contact", "company"] else "transaction"
+        for raw_entities, next_after in self.get_raw_entities_pages(
+            hs_type, after=after, limit=limit, **kwargs
+        ):
+            raw_entities = self.embed_associations(hs_type, raw_entities, **kwargs)
+            raw_entities = getattr(self, f"tx_{entity_type}s_src_ext")(raw_entities, **kwargs)
+            yield [
+                getattr(self, f"tx_{entity_type}_src")(raw_entity, **kwargs)
+                for raw_entity in raw_entities
+            ], next_after
+
+    def get_raw_entities_pages(self, hs_type, after=None, limit=BATCH_LIMIT, **kwargs):
+        updated_at = self.setting["src_metadata"][kwargs.get("target")][kwargs.get("tx_type")]["updated_at"]
+        # HubSpot stops paging a search at 10k results, so the cursor restarts the window
+        # at the last updated_at read and skips the records already returned at that instant.
+        cursor = {
+            "window_start": int(to_hubspot_timestamp(kwargs["cut_date"])) if kwargs.get("cut_date") else None,
+            "after": None,
+            "seen": [],
+        }
+        if isinstance(after, dict):
+            cursor.update(after)
+        elif after is not None:
+            cursor["after"] = after
+        boundary, boundary_ids = cursor["window_start"], list(cursor["seen"])
+        limit = min(int(limit), SEARCH_LIMIT)
+        page_size = self.get_page_size(hs_type)
+        while True:
+            filters = []
+            if cursor["window_start"] is not None:
+                filters.append(
+                    {"propertyName": updated_at, "operator": "GTE", "value": str(cursor["window_start"])}
+                )
+            if kwargs.get("end_date"):
+                filters.append(
+                    {"propertyName": updated_at, "operator": "LT", "value": to_hubspot_timestamp(kwargs["end_date"])}
+                )
+            search_request = {
+                "filterGroups": [{"filters": filters}] if len(filters) > 0 else [],
+                "sorts": [{"propertyName": updated_at, "direction": "ASCENDING"}],
+                "properties": self.setting.get(f"{hs_type}_properties"),
+                "limit": min(page_size.size, limit),
+            }
+            if cursor["after"] is not None:
+                search_request["after"] = cursor["after"]
+            response = self.search_objects(hs_type, search_request, page_size=page_size)
+            seen = set(cursor["seen"])
+            results = [result for result in response.results if str(result.id) not in seen]
+            for result in results:
+                value = result.properties.get(updated_at)
+                timestamp = int(to_hubspot_timestamp(value)) if value else None
+                if timestamp != boundary:
+                    boundary, boundary_ids = timestamp, []
+                boundary_ids.append(str(result.id))
+            next_after = (
+                response.paging.next.after
+                if response.paging is not None and response.paging.next is not None
+                else None
+            )
+            if next_after is None:
+                cursor = None
+            elif (
+                boundary is not None
+                and str(next_after).isdigit()
+                and int(next_after) + limit > SEARCH_RESULT_LIMIT
+            ):
+                if boundary == cursor["window_start"]:
+                    self.logger.warning(
+                        f"More than {SEARCH_RESULT_LIMIT} {hs_type} records share {updated_at} {boundary}, the rest of them are skipped."
+                    )
+                    boundary, boundary_ids = boundary + 1, []
+                cursor = {"window_start": boundary, "after": None, "seen": list(boundary_ids)}
+            else:
+                cursor = dict(cursor, after=next_after)
+            yield [result.properties for result in results], cursor
+            if cursor is None:
+                break
+
+    def get_page_size(self, hs_type):
+        # One controller per object type, so what a search learns carries over to the next one.
+        with self.page_sizes_lock:
+            if hs_type not in self.page_sizes:
+                self.page_sizes[hs_type] = AdaptivePageSize(
+                    maximum=SEARCH_LIMIT,
+                    target_latency=self.setting.get("search_target_latency", 2),
+                )
+            return self.page_sizes[hs_type]
+
+    def search_objects(self, hs_type, search_request, page_size=None):
+        started_at = time.perf_counter()
+        response, retries = self.hubspot_connector.call_with_retries(
+            self.get_crm_api(hs_type).search_api.do_search,
+            public_object_search_request=search_request,
+        )
+        if page_size is not None:
+            page_size.observe(time.perf_counter() - started_at, throttled=retries > 0)
+        return response
+
+    def get_checkpoint(self, **kwargs):
+        checkpoint = self.state_store.get("checkpoint", kwargs.get("target"), kwargs.get("tx_type"))
+        if checkpoint is None or checkpoint.get("cut_date") != str(kwargs.get("cut_date")):
+            return None
+        self.logger.info(f"Resume {kwargs.get('tx_type')} from checkpoint {checkpoint['after']}.")
+        return checkpoint["after"]
+
+    def save_checkpoint(self, after, **kwargs):
+        if after is None:
+            self.state_store.invalidate("checkpoint", kwargs.get("target"), kwargs.get("tx_type"))
+            return
+        self.state_store.set(
+            {"after": after, "cut_date": str(kwargs.get("cut_date"))},
+            "checkpoint",
+            kwargs.get("target"),
+            kwargs.get("tx_type"),
+        )
 
     def tx_transaction_src(self, raw_transaction, **kwargs):
         tx_type = kwargs.get("tx_type")
@@ -72,6 +480,9 @@ class HubspotAgency(Agency):
 
     def tx_transaction_src_ext(self, raw_transaction, **kwargs):
         return raw_transaction
+
+    def tx_transactions_src_ext(self, raw_transactions, **kwargs):
+        return raw_transactions
     
     def tx_transaction_tgt(self, transaction):
         return transaction
@@ -80,8 +491,8 @@ class HubspotAgency(Agency):
         pass
 
     def insert_update_transactions(self, transactions):
-        for transaction in transactions:
-            self.insert_update_entity(transaction)
+        self.metrics.increment("records", len(transactions))
+        self.map_entities(self.insert_update_entity, transactions)
         return transactions
     
     
@@ -126,7 +537,7 @@ class HubspotAgency(Agency):
                 ignore_properties=[],
                 properties=self.setting.get("company_properties")
             )
-        elif hs_type == "contact":
+        elif hs_type == "contact" and "primary_company" not in raw_person:
             primary_company_id = self.hubspot_connector.get_contact_primary_company_id(raw_person["hs_object_id"])
             primary_company = None
             if primary_company_id:
@@ -137,11 +548,156 @@ class HubspotAgency(Agency):
                     pass
             raw_person["primary_company"] = primary_company
         return raw_person
-    
+
+    def tx_persons_src_ext(self, raw_persons, **kwargs):
+        # Page-level enrichment; tx_person_src_ext falls back to per-record lookups if this fails.
+        hs_type = self.get_hs_type(kwargs.get("tx_type"))
+        if hs_type == "company" and len(raw_persons) > 0:
+            try:
+                self.convert_datetimes_page(
+                    "company", raw_persons, properties=self.setting.get("company_properties")
+                )
+            except Exception:
+                log = traceback.format_exc()
+                self.logger.exception(f"Failed to prepare company page with error: {log}")
+            return raw_persons
+        # Contacts exported with their company associations already carry primary_company.
+        raw_persons_to_enrich = [
+            raw_person for raw_person in raw_persons if "primary_company" not in raw_person
+        ]
+        if hs_type != "contact" or len(raw_persons_to_enrich) == 0:
+            return raw_persons
+        try:
+            primary_company_ids = self.get_contacts_primary_company_ids(
+                [str(raw_person["hs_object_id"]) for raw_person in raw_persons_to_enrich]
+            )
+            company_ids = sorted(set(primary_company_ids.values()))
+            companies = {
+                str(company.id): company.properties
+                for company in self.get_companies_by_ids(hs_object_ids=company_ids)
+            }
+            for raw_person in raw_persons_to_enrich:
+                company_id = primary_company_ids.get(str(raw_person["hs_object_id"]))
+                raw_person["primary_company"] = companies.get(company_id) if company_id else None
+        except Exception:
+            log = traceback.format_exc()
+            self.logger.exception(f"Failed to enrich contacts by page with error: {log}")
+        return raw_persons
+
+    def get_contacts_primary_company_ids(self, contact_ids):
+        return self.get_primary_company_ids(self.get_associations("contacts", "companies", contact_ids))
+
+    def get_primary_company_ids(self, associations):
+        primary_company_ids = {}
+        for contact_id, contact_associations in associations.items():
+            for association in contact_associations:
+                if any(
+                    association_type.type_id == PRIMARY_COMPANY_ASSOCIATION_TYPE_ID
+                    for association_type in association.association_types or []
+                ):
+                    primary_company_ids[contact_id] = str(association.to_object_id)
+                    break
+        return primary_company_ids
+
+    def get_associations(self, from_object_type, to_object_type, object_ids):
+        associations = {}
+        for i in range(0, len(object_ids), BATCH_LIMIT):
+            response = self.hubspot_connector.call(
+                self.hubspot_connector.hubspot.crm.associations.v4.batch_api.get_page,
+                from_object_type=from_object_type,
+                to_object_type=to_object_type,
+                batch_input_public_fetch_associations_batch_request={
+                    "inputs": [{"id": str(object_id)} for object_id in object_ids[i : i + BATCH_LIMIT]]
+                },
+            )
+            for result in response.results or []:
+                associations[str(result._from.id)] = result.to or []
+        return associations
+
+    def embed_associations(self, hs_type, raw_entities, **kwargs):
+        # associations: {tx_type: {to_object_type: properties}}, e.g. {"deal": {"line_items": ["name", "quantity"]}}.
+        associations_setting = self.setting.get("associations", {}).get(kwargs.get("tx_type"), {})
+        if len(associations_setting) == 0 or len(raw_entities) == 0:
+            return raw_entities
+        object_ids = [str(raw_entity["hs_object_id"]) for raw_entity in raw_entities]
+        embedded_associations = {object_id: {} for object_id in object_ids}
+        for to_object_type, properties in associations_setting.items():
+            associations = self.get_associations(
+                CRM_OBJECTS.get(hs_type, f"{hs_type}s"), to_object_type, object_ids
+            )
+            associated_objects = self.batch_read_objects(
+                to_object_type,
+                sorted(
+                    set(
+                        str(association.to_object_id)
+                        for object_associations in associations.values()
+                        for association in object_associations
+                    )
+                ),
+                properties=properties,
+            )
+            for object_id in object_ids:
+                embedded_associations[object_id][to_object_type] = [
+                    associated_objects[str(association.to_object_id)]
+                    for association in associations.get(object_id, [])
+                    if str(association.to_object_id) in associated_objects
+                ]
+            if hs_type == "contact" and to_object_type == "companies":
+                self.set_primary_companies(
+                    raw_entities,
+                    associations,
+                    associated_objects if properties == self.setting.get("company_properties") else None,
+                )
+        for raw_entity in raw_entities:
+            raw_entity["associations"] = embedded_associations[str(raw_entity["hs_object_id"])]
+        return raw_entities
+
+    def set_primary_companies(self, raw_persons, associations, companies=None):
+        primary_company_ids = self.get_primary_company_ids(associations)
+        # primary_company keeps the company_properties shape whatever the association reads.
+        if companies is None:
+            companies = self.batch_read_objects(
+                "companies",
+                sorted(set(primary_company_ids.values())),
+                properties=self.setting.get("company_properties", []),
+            )
+        for raw_person in raw_persons:
+            company_id = primary_company_ids.get(str(raw_person["hs_object_id"]))
+            raw_person["primary_company"] = companies.get(company_id) if company_id else None
+
+    def batch_read_objects(self, object_type, object_ids, properties=None):
+        objects = {}
+        for i in range(0, len(object_ids), BATCH_LIMIT):
+            response = self.hubspot_connector.call(
+                getattr(self.hubspot_connector.hubspot.crm, object_type).batch_api.read,
+                batch_read_input_simple_public_object_id={
+                    "inputs": [{"id": object_id} for object_id in object_ids[i : i + BATCH_LIMIT]],
+                    "properties": properties or [],
+                },
+            )
+            for result in response.results or []:
+                objects[str(result.id)] = result.properties
+        return objects
+
     def get_companies_by_ids(self, **params):
-        hs_object_ids = params.get("hs_object_ids", [])
+        # IN filters take at most 100 values, so the IDs are read in partitions and merged in input order.
+        hs_object_ids = list(dict.fromkeys(str(hs_object_id) for hs_object_id in params.get("hs_object_ids", [])))
         if len(hs_object_ids) == 0:
             return []
+        properties = self.setting.get("company_properties", None)
+        partitions = [
+            hs_object_ids[i : i + BATCH_LIMIT] for i in range(0, len(hs_object_ids), BATCH_LIMIT)
+        ]
+        companies = {}
+        for partition in self.map_entities(
+            lambda partition: self.get_companies_partition(partition, properties), partitions
+        ):
+            for company in partition:
+                companies.setdefault(str(company.id), company)
+        companies = [companies[hs_object_id] for hs_object_id in hs_object_ids if hs_object_id in companies]
+        return companies[: int(params.get("limit", len(companies)))]
+
+    def get_companies_partition(self, hs_object_ids, properties):
         company_params = {}
         company_params["filter_groups"] = [
             {
@@ -154,152 +710,513 @@ class HubspotAgency(Agency):
                 ]
             }
         ]
-        limit_count = params.get("limit", 100)
-        limit = 100
-        if int(limit_count) < limit:
-            limit = limit_count
-        company_params['limit_count'] = limit_count
-        company_params["limit"] = limit
-        company_params["properties"] = self.setting.get("company_properties", None)
+        company_params["limit_count"] = len(hs_object_ids)
+        company_params["limit"] = len(hs_object_ids)
+        company_params["properties"] = properties
         return self.hubspot_connector.get_companies(**company_params)
     
+    @timed("tx_person_tgt")
     def tx_person_tgt(self, person):
         tx_type = person.get("tx_type_src_id").split("-")[0]
         hs_type = self.get_hs_type(tx_type)
-        if hs_type == "contact":
-            hubspot_properties = self.get_properties_can_be_processed(object_type=hs_type)
-        elif hs_type == "company":
-            hubspot_properties = self.get_properties_can_be_processed(object_type=hs_type)
-        new_person = copy.deepcopy(person)
-        for property_name, value in person["data"].items():
-            if property_name not in hubspot_properties and property_name != "attachments":
-                new_person["data"].pop(property_name)
-            elif property_name in hubspot_properties:
-                if hubspot_properties[property_name]["field_type"] == "file":
-                    try:
-                        if isinstance(person["data"][property_name], dict):
-                            file_id = self.hubspot_connector.upload_file_by_url(**person["data"][property_name])
-                            new_person["data"][property_name] = file_id
-                        elif isinstance(person["data"][property_name], list):
-                            file_ids = []
-                            for file_data in person["data"][property_name]:
-                                if isinstance(file_data, dict):
-                                    file_id = self.hubspot_connector.upload_file_by_url(**file_data)
-                                    file_ids.append(file_id)
-                            new_person["data"][property_name] = ";".join(file_ids)
-                    except Exception as e:
-                        new_person["data"].pop(property_name)
-                        self.logger.error(e)
-                        pass
-                elif hubspot_properties[property_name].get("type") == "enumeration" and hubspot_properties[property_name].get("referenced_object_type") == "OWNER":
-                    owner = self.get_owner_by_name(value)
-                    if owner is not None:
-                        new_person["data"][property_name] = owner.id
-                    else:
-                        new_person["data"].pop(property_name)
+        properties_names, file_properties, owner_properties = self.get_target_properties(hs_type)
+        # Project the allowed properties instead of deep copying the whole entity.
+        new_person = dict(
+            person,
+            data={
+                property_name: value
+                for property_name, value in person["data"].items()
+                if property_name in properties_names or property_name == "attachments"
+            },
+        )
+        file_ids = self.upload_files(
+            [
+                file_data
+                for property_name in file_properties.intersection(new_person["data"].keys())
+                for file_data in (
+                    new_person["data"][property_name]
+                    if isinstance(new_person["data"][property_name], list)
+                    else [new_person["data"][property_name]]
+                )
+                if isinstance(file_data, dict)
+            ]
+        )
+        owners = (
+            self.owner_index.resolve(
+                [
+                    new_person["data"][property_name]
+                    for property_name in owner_properties.intersection(new_person["data"].keys())
+                ]
+            )
+            if not owner_properties.isdisjoint(new_person["data"].keys())
+            else {}
+        )
+        for property_name in [
+            property_name
+            for property_name in new_person["data"].keys()
+            if property_name in file_properties or property_name in owner_properties
+        ]:
+            value = new_person["data"][property_name]
+            if property_name in file_properties:
+                try:
+                    if isinstance(value, dict):
+                        new_person["data"][property_name] = get_file_id(file_ids, value)
+                    elif isinstance(value, list):
+                        new_person["data"][property_name] = ";".join(
+                            [
+                                get_file_id(file_ids, file_data)
+                                for file_data in value
+                                if isinstance(file_data, dict)
+                            ]
+                        )
+                except Exception as e:
+                    new_person["data"].pop(property_name)
+                    self.logger.error(e)
+                    pass
+            else:
+                owner = owners.get(value) if isinstance(value, str) else None
+                if owner is not None:
+                    new_person["data"][property_name] = owner.id
+                else:
+                    new_person["data"].pop(property_name)
         return new_person
 
+    def get_target_properties(self, object_type):
+        if object_type not in self.target_properties:
+            hubspot_properties = self.get_properties_can_be_processed(object_type=object_type)
+            self.target_properties[object_type] = (
+                frozenset(hubspot_properties.keys()),
+                frozenset(
+                    property_name
+                    for property_name, property_setting in hubspot_properties.items()
+                    if property_setting["field_type"] == "file"
+                ),
+                frozenset(
+                    property_name
+                    for property_name, property_setting in hubspot_properties.items()
+                    if property_setting["field_type"] != "file"
+                    and property_setting.get("type") == "enumeration"
+                    and property_setting.get("referenced_object_type") == "OWNER"
+                ),
+            )
+        return self.target_properties[object_type]
+
     def tx_person_tgt_ext(self, new_person, person):
         pass
 
+    @timed("upload_files")
+    def upload_files(self, files):
+        # With file_cache_ttl set, a file is uploaded again when the ETag/Last-Modified behind its
+        # URL changes; files whose server sends neither are uploaded on every sync, as before.
+        files = {get_file_key(file_data): file_data for file_data in files}
+        upload_workers = int(self.setting.get("upload_workers", self.max_workers))
+        file_keys = list(files.keys())
+        versions = {file_key: None for file_key in file_keys}
+        if self.setting.get("file_cache_ttl"):
+            versions = dict(
+                zip(
+                    file_keys,
+                    self.map_entities(
+                        lambda file_key: self.get_file_version(files[file_key]),
+                        file_keys,
+                        max_workers=upload_workers,
+                    ),
+                )
+            )
+        file_ids = {}
+        for file_key, version in versions.items():
+            file_id = self.state_store.get("file", file_key, version) if version is not None else None
+            if file_id is not None:
+                file_ids[file_key] = file_id
+
+        def upload_file(file_key):
+            try:
+                file_id = self.hubspot_connector.upload_file_by_url(**files[file_key])
+                if versions[file_key] is not None:
+                    self.state_store.set(
+                        file_id,
+                        "file",
+                        file_key,
+                        versions[file_key],
+                        ttl=self.setting["file_cache_ttl"],
+                    )
+                return file_id
+            except Exception as e:
+                return e
+
+        pending_file_keys = [file_key for file_key in file_keys if file_key not in file_ids]
+        file_ids.update(
+            zip(
+                pending_file_keys,
+                self.map_entities(upload_file, pending_file_keys, max_workers=upload_workers),
+            )
+        )
+        return file_ids
+
+    def get_file_version(self, file_data):
+        try:
+            return get_file_version(file_data["url"])
+        except Exception:
+            self.logger.info(f"No version for file {file_data.get('url')}: {traceback.format_exc()}")
+            return None
+
     def insert_update_persons(self, persons):
+        self.metrics.increment("records", len(persons))
+        changed_persons = self.skip_unchanged_entities(persons)
+        if self.setting.get("batch_upsert", False):
+            self.batch_insert_update_persons(changed_persons)
+        else:
+            self.map_entities(self.insert_update_person, changed_persons)
+        self.save_fingerprints(changed_persons)
+        return persons
+
+    def insert_update_person(self, person):
+        tx_type = person.get("tx_type_src_id").split("-")[0]
+        hs_type = self.get_hs_type(tx_type)
+        try:
+            if hs_type == "contact":
+                person["tgt_id"] = self.hubspot_connector.insert_update_contact(
+                    person["data"], id_property=self.setting["id_property"][tx_type]
+                )
+            elif hs_type == "company":
+                person["tgt_id"] = self.hubspot_connector.insert_update_company(
+                    person["data"], id_property=self.setting["id_property"][tx_type]
+                )
+            else:
+                raise Exception(f"{tx_type} is not supported.")
+            person["tx_status"] = "S"
+        except Exception:
+            log = traceback.format_exc()
+            person.update({"tx_status": "F", "tx_note": log, "tgt_id": "####"})
+            self.logger.exception(
+                f"Failed to create person: {person['tx_type_src_id']} with error: {log}"
+            )
+        return person
+
+    def batch_insert_update_persons(self, persons):
+        groups = {}
         for person in persons:
             tx_type = person.get("tx_type_src_id").split("-")[0]
             hs_type = self.get_hs_type(tx_type)
+            id_property = self.setting.get("id_property", {}).get(tx_type)
+            # Attachments are handled by the connector, so keep those records on the per-record path.
+            if (
+                hs_type not in ["contact", "company"]
+                or id_property is None
+                or person["data"].get(id_property) is None
+                or "attachments" in person["data"]
+            ):
+                self.insert_update_person(person)
+                continue
+            groups.setdefault((hs_type, id_property), []).append(person)
+
+        self.batch_entities(groups, self.batch_upsert_objects, self.insert_update_person)
+        return persons
+
+    def batch_entities(self, groups, batch_funct, fallback_funct):
+        def batch_chunk(hs_type, id_property, chunk):
             try:
-                if hs_type == "contact":
-                    person["tgt_id"] = self.hubspot_connector.insert_update_contact(
-                        person["data"], id_property=self.setting["id_property"][tx_type]
-                    )
-                elif hs_type == "company":
-                    person["tgt_id"] = self.hubspot_connector.insert_update_company(
-                        person["data"], id_property=self.setting["id_property"][tx_type]
-                    )
-                else:
-                    raise Exception(f"{tx_type} is not supported.")
-                person["tx_status"] = "S"
+                batch_funct(hs_type, id_property, chunk)
             except Exception:
                 log = traceback.format_exc()
-                person.update({"tx_status": "F", "tx_note": log, "tgt_id": "####"})
                 self.logger.exception(
-                    f"Failed to create person: {person['tx_type_src_id']} with error: {log}"
+                    f"Failed to batch upsert {len(chunk)} {hs_type} records, fall back to per-record calls with error: {log}"
                 )
-        return persons
+                for entity in chunk:
+                    fallback_funct(entity)
+            return chunk
+
+        batch_size = min(int(self.setting.get("batch_size", BATCH_LIMIT)), BATCH_LIMIT)
+        chunks = [
+            (hs_type, id_property, group[i : i + batch_size])
+            for (hs_type, id_property), group in groups.items()
+            for i in range(0, len(group), batch_size)
+        ]
+        return self.map_entities(lambda chunk: batch_chunk(*chunk), chunks)
+
+    def batch_upsert_objects(self, hs_type, id_property, entities):
+        response = self.hubspot_connector.call(
+            self.get_crm_api(hs_type).batch_api.upsert,
+            batch_input_simple_public_object_batch_input_upsert={
+                "inputs": [
+                    {
+                        "idProperty": id_property,
+                        "id": str(entity["data"][id_property]),
+                        "properties": entity["data"],
+                    }
+                    for entity in entities
+                ]
+            }
+        )
+        # HubSpot normalizes emails to lower case in the response.
+        normalize = (lambda value: str(value).lower()) if id_property == "email" else str
+        tgt_ids = {
+            normalize(result.properties.get(id_property)): result.id
+            for result in (response.results or [])
+            if result.properties is not None
+        }
+        errors = self.get_batch_errors(response, normalize)
+        return self.set_batch_results(hs_type, id_property, entities, tgt_ids, errors, normalize=normalize)
+
+    def get_batch_errors(self, response, get_id_value):
+        errors = {}
+        for error in getattr(response, "errors", None) or []:
+            for error_id in (error.context or {}).get("ids", []):
+                errors[get_id_value(error_id)] = error.message
+        return errors
+
+    def set_batch_results(self, hs_type, id_property, entities, tgt_ids, errors, normalize=str):
+        for entity in entities:
+            id_value = normalize(entity["data"][id_property])
+            if id_value in tgt_ids:
+                entity.update({"tgt_id": tgt_ids[id_value], "tx_status": "S"})
+            else:
+                log = errors.get(id_value, f"No result returned for {id_property}: {id_value}.")
+                entity.update({"tx_status": "F", "tx_note": log, "tgt_id": "####"})
+                self.logger.error(
+                    f"Failed to batch upsert {hs_type}: {entity['tx_type_src_id']} with error: {log}"
+                )
+        return entities
+
+    def map_entities(self, funct, entities, max_workers=None):
+        return map_in_order(funct, entities, max_workers or self.max_workers)
+
+    def get_crm_api(self, hs_type):
+        return getattr(self.hubspot_connector.hubspot.crm, CRM_OBJECTS.get(hs_type, f"{hs_type}s"))
 
     def tx_asset_tgt(self, asset):
-        return asset
+        tx_type = asset.get("tx_type_src_id").split("-")[0]
+        hs_type = self.get_hs_type(tx_type)
+        if hs_type != "product":
+            return asset
+        properties_names, _, _ = self.get_target_properties(hs_type)
+        return dict(
+            asset,
+            data={
+                property_name: value
+                for property_name, value in asset["data"].items()
+                if property_name in properties_names
+            },
+        )
 
     def tx_asset_tgt_ext(self, new_asset, asset):
         pass
 
     def insert_update_assets(self, assets):
+        self.metrics.increment("records", len(assets))
+        changed_assets = self.skip_unchanged_entities(assets)
+        if self.setting.get("batch_upsert", False):
+            self.batch_insert_update_assets(changed_assets)
+        else:
+            self.map_entities(self.insert_update_asset, changed_assets)
+        self.save_fingerprints(changed_assets)
+        return assets
+
+    def batch_insert_update_assets(self, assets):
+        groups, id_values, repeated_assets = {}, set(), []
         for asset in assets:
             tx_type = asset.get("tx_type_src_id").split("-")[0]
             hs_type = self.get_hs_type(tx_type)
-            try:
-                if hs_type == "product":
-                    asset["tgt_id"] = self.hubspot_connector.insert_update_product(
-                        asset["data"], id_property=self.setting["id_property"][tx_type]
-                    )
-                else:
-                    raise Exception(f"{tx_type} is not supported.")
-                asset["tx_status"] = "S"
-            except Exception:
-                log = traceback.format_exc()
-                asset.update({"tx_status": "F", "tx_note": log, "tgt_id": "####"})
-                self.logger.exception(
-                    f"Failed to create asset: {asset['tx_type_src_id']} with error: {log}"
-                )
+            id_property = self.setting.get("id_property", {}).get(tx_type)
+            if hs_type != "product" or id_property is None or asset["data"].get(id_property) is None:
+                self.insert_update_asset(asset)
+                continue
+            # A batch create would make one product per repeat, so repeats run per record once the batch is done.
+            id_value = (hs_type, id_property, str(asset["data"][id_property]))
+            if id_value in id_values:
+                repeated_assets.append(asset)
+                continue
+            id_values.add(id_value)
+            groups.setdefault((hs_type, id_property), []).append(asset)
+
+        self.batch_entities(groups, self.batch_create_update_objects, self.insert_update_asset)
+        for asset in repeated_assets:
+            self.insert_update_asset(asset)
         return assets
+
+    def batch_create_update_objects(self, hs_type, id_property, entities):
+        # For id properties HubSpot cannot upsert on (e.g. hs_sku), look the IDs up and split creates from updates.
+        crm_api = self.get_crm_api(hs_type)
+        existing_ids = self.search_ids_by_property(
+            hs_type, id_property, [str(entity["data"][id_property]) for entity in entities]
+        )
+        entities_to_create = [
+            entity for entity in entities if str(entity["data"][id_property]) not in existing_ids
+        ]
+        entities_to_update = [
+            entity for entity in entities if str(entity["data"][id_property]) in existing_ids
+        ]
+        tgt_ids, errors = {}, {}
+        # Update errors name the HubSpot object IDs, create errors name the id property values.
+        id_values = {str(tgt_id): id_value for id_value, tgt_id in existing_ids.items()}
+        get_id_value = lambda error_id: id_values.get(str(error_id), str(error_id))
+        if len(entities_to_create) > 0:
+            response = self.hubspot_connector.call(
+                crm_api.batch_api.create,
+                batch_input_simple_public_object_input_for_create={
+                    "inputs": [{"properties": entity["data"]} for entity in entities_to_create]
+                },
+            )
+            tgt_ids.update(
+                {
+                    str(result.properties.get(id_property)): result.id
+                    for result in (response.results or [])
+                    if result.properties is not None
+                }
+            )
+            errors.update(self.get_batch_errors(response, get_id_value))
+        if len(entities_to_update) > 0:
+            response = self.hubspot_connector.call(
+                crm_api.batch_api.update,
+                batch_input_simple_public_object_batch_input={
+                    "inputs": [
+                        {
+                            "id": existing_ids[str(entity["data"][id_property])],
+                            "properties": entity["data"],
+                        }
+                        for entity in entities_to_update
+                    ]
+                },
+            )
+            updated_ids = set(str(result.id) for result in (response.results or []))
+            tgt_ids.update(
+                {
+                    id_value: tgt_id
+                    for id_value, tgt_id in existing_ids.items()
+                    if str(tgt_id) in updated_ids
+                }
+            )
+            errors.update(self.get_batch_errors(response, get_id_value))
+        return self.set_batch_results(hs_type, id_property, entities, tgt_ids, errors)
+
+    def search_ids_by_property(self, hs_type, property_name, values):
+        ids = {}
+        partitions = [values[i : i + BATCH_LIMIT] for i in range(0, len(values), BATCH_LIMIT)]
+        for partition in self.map_entities(
+            lambda partition: self.search_ids_partition(hs_type, property_name, partition), partitions
+        ):
+            for value, hs_object_id in partition:
+                ids.setdefault(value, hs_object_id)
+        return ids
+
+    def search_ids_partition(self, hs_type, property_name, values):
+        ids = []
+        page_size = self.get_page_size(hs_type)
+        search_request = {
+            "filterGroups": [
+                {"filters": [{"propertyName": property_name, "operator": "IN", "values": values}]}
+            ],
+            "properties": [property_name],
+        }
+        while True:
+            search_request["limit"] = page_size.size
+            response = self.search_objects(hs_type, search_request, page_size=page_size)
+            for result in response.results or []:
+                ids.append((str(result.properties.get(property_name)), result.id))
+            if response.paging is None or response.paging.next is None:
+                break
+            search_request["after"] = response.paging.next.after
+        return ids
+
+    def skip_unchanged_entities(self, entities):
+        if not self.setting.get("change_detection", False) or self.setting.get("force_resync", False):
+            return entities
+        changed_entities = []
+        for entity in entities:
+            fingerprint = self.state_store.get("fingerprint", entity["tx_type_src_id"])
+            if fingerprint is not None and fingerprint["hash"] == get_fingerprint(entity["data"]):
+                entity.update(
+                    {
+                        "tgt_id": fingerprint["tgt_id"],
+                        "tx_status": "S",
+                        "tx_note": "Skipped: data is unchanged since the last sync.",
+                    }
+                )
+                self.metrics.increment("skipped")
+            else:
+                changed_entities.append(entity)
+        return changed_entities
+
+    def save_fingerprints(self, entities):
+        if not self.setting.get("change_detection", False):
+            return
+        for entity in entities:
+            if entity.get("tx_status") == "S":
+                self.state_store.set(
+                    {"hash": get_fingerprint(entity["data"]), "tgt_id": entity["tgt_id"]},
+                    "fingerprint",
+                    entity["tx_type_src_id"],
+                )
+
+    def insert_update_asset(self, asset):
+        tx_type = asset.get("tx_type_src_id").split("-")[0]
+        hs_type = self.get_hs_type(tx_type)
+        try:
+            if hs_type == "product":
+                asset["tgt_id"] = self.hubspot_connector.insert_update_product(
+                    asset["data"], id_property=self.setting["id_property"][tx_type]
+                )
+            else:
+                raise Exception(f"{tx_type} is not supported.")
+            asset["tx_status"] = "S"
+        except Exception:
+            log = traceback.format_exc()
+            asset.update({"tx_status": "F", "tx_note": log, "tgt_id": "####"})
+            self.logger.exception(
+                f"Failed to create asset: {asset['tx_type_src_id']} with error: {log}"
+            )
+        return asset
     
     def get_owner_by_name(self, sales_rep):
         if isinstance(sales_rep, str):
-            owners_name_mapping = self.get_owners_name_mapping()
-            return owners_name_mapping.get(sales_rep.lower(), None)
+            return self.owner_index.get_owner(sales_rep)
         return None
-    
+
     def get_hubspot_user_by_id(self, hubspot_user_id):
         hubspot_users = self.get_all_hubspot_users()
         return hubspot_users.get(str(hubspot_user_id), None)
-    
+
     def get_hubspot_user_name_by_id(self, hubspot_user_id):
-        hubspot_users = self.get_all_hubspot_users()
-        user = hubspot_users.get(str(hubspot_user_id), None)
-        if user is None:
-            return None
-        if user.archived:
-            return "{first_name} {last_name} (Deactivated User)".format(first_name=user.first_name, last_name=user.last_name)
-        else:
-            return "{first_name} {last_name}".format(first_name=user.first_name, last_name=user.last_name)
-    
+        return self.owner_index.get_display_name(hubspot_user_id)
+
     def get_owners_name_mapping(self):
-        if len(self.all_owners) == 0:
-            owners = self.get_all_hubspot_users()
-            for owner_id, owner in owners.items():
-                owner_name = "{first_name} {last_name}".format(first_name=owner.first_name, last_name=owner.last_name)
-                self.all_owners[owner_name.lower()] = owner
-        return self.all_owners
-    
+        return self.owner_index.get_names()
+
     def get_all_hubspot_users(self):
-        if len(self.hubspot_users) > 0:
-            return self.hubspot_users
-        hubspot_users = self.hubspot_connector.get_all_owners()
-        for user in hubspot_users:
-            self.hubspot_users[str(user.id)] = user
-        return self.hubspot_users
-    
+        return self.owner_index.get_owners()
+
+    def load_hubspot_users(self, reload=False):
+        # A TTL refresh reloads from HubSpot, the cached owners are what it replaces.
+        hubspot_users = None if reload else self.metadata_cache.get("owners")
+        if hubspot_users is None:
+            # Keep plain attributes only so the owners can be pickled by the cache backend.
+            hubspot_users = self.metadata_cache.set(
+                {
+                    str(user.id): SimpleNamespace(**user.to_dict())
+                    for user in self.hubspot_connector.get_all_owners()
+                },
+                "owners",
+            )
+        return hubspot_users
+
     def get_hubspot_team_label_by_id(self, hubspot_team_id):
         hubspot_team_options = self.get_hubspot_team_options()
         return hubspot_team_options.get(str(hubspot_team_id), None)
     
     def get_hubspot_team_options(self):
+        if self.hubspot_team_options is not None:
+            return self.hubspot_team_options
+        self.hubspot_team_options = self.metadata_cache.get("teams")
         if self.hubspot_team_options is not None:
             return self.hubspot_team_options
         try:
-            hubspot_teams_result = self.hubspot_connector.hubspot.settings.users.teams_api.get_all()
+            hubspot_teams_result = self.hubspot_connector.call(
+                self.hubspot_connector.hubspot.settings.users.teams_api.get_all
+            )
             self.hubspot_team_options = {}
             for team in hubspot_teams_result.results:
                 self.hubspot_team_options[str(team.id)] = team.name
+            self.metadata_cache.set(self.hubspot_team_options, "teams")
         except Exception as e:
             self.logger.info(str(e))
             pass
@@ -310,12 +1227,19 @@ class HubspotAgency(Agency):
     def get_hubspot_properties(self, object_type, properties=None):
         if object_type in self.hubspot_properties:
             return self.hubspot_properties.get(object_type)
+        self.hubspot_properties[object_type] = self.metadata_cache.get("properties", object_type)
+        if self.hubspot_properties[object_type] is not None:
+            return self.hubspot_properties[object_type]
         try:
             response = self.hubspot_connector.get_properties_by_object_type(object_type, properties)
-            self.hubspot_properties[object_type] = [
-                property_model.to_dict()
-                for property_model in response.results
-            ]
+            self.hubspot_properties[object_type] = self.metadata_cache.set(
+                [
+                    property_model.to_dict()
+                    for property_model in response.results
+                ],
+                "properties",
+                object_type,
+            )
         except Exception as e:
             self.logger.info(str(e))
             self.hubspot_properties[object_type] = None
@@ -340,9 +1264,30 @@ class HubspotAgency(Agency):
             else:
                 process_properties[name]["options_mapping"] = {}
         self.properties_can_process[object_type] = process_properties
+        self.properties_plans.pop(object_type, None)
+        self.target_properties.pop(object_type, None)
 
         return self.properties_can_process[object_type]
     
+    def invalidate_metadata_cache(self, *parts):
+        # parts: () for all the metadata of the portal, ("owners",), ("teams",) or ("properties", object_type).
+        if len(parts) == 0:
+            for cache_parts in [("properties",), ("owners",), ("teams",)]:
+                self.metadata_cache.invalidate(*cache_parts)
+        else:
+            self.metadata_cache.invalidate(*parts)
+        if len(parts) == 0 or parts[0] == "owners":
+            self.owner_index.invalidate()
+        if len(parts) == 0 or parts[0] == "teams":
+            self.hubspot_team_options = None
+        if len(parts) == 0 or parts[0] == "properties":
+            for object_type in list(self.hubspot_properties.keys()):
+                if len(parts) < 2 or parts[1] == object_type:
+                    self.hubspot_properties.pop(object_type, None)
+                    self.properties_can_process.pop(object_type, None)
+                    self.properties_plans.pop(object_type, None)
+                    self.target_properties.pop(object_type, None)
+
     def format_property_value(self, property_setting, value):
         if value is None:
             return value
@@ -359,32 +1304,134 @@ class HubspotAgency(Agency):
         elif property_setting.get("type") == "enumeration" and property_setting.get("referenced_object_type") == "OWNER":
             return self.get_hubspot_user_name_by_id(value)
         elif property_setting.get("type") == "number" and property_setting.get("referenced_object_type") == "COMPANY":
-            company =  self.hubspot_connector.get_company(value)
+            company = self.hubspot_connector.get_company(value)
             if company is not None:
                 return company.properties.get("name")
             else:
                 return None
-            
+
         return value
-    
+
+    @timed("process_hubspot_properties_values")
     def process_hubspot_properties_values(self, object_type, properties_data, ignore_properties=[], properties=None):
+        for property_name, process_property in self.get_properties_plan(
+            object_type, properties_data.keys(), ignore_properties, properties
+        ):
+            if property_name in properties_data:
+                process_property(properties_data)
+        return properties_data
+
+    def get_properties_plan(self, object_type, keys, ignore_properties=[], properties=None):
         process_properties = self.get_properties_can_be_processed(object_type, properties)
-        convert_timezone = self.setting.get("convert_timezone_settings", {})
+        plans = self.properties_plans.setdefault(object_type, {})
+        plan_key = (frozenset(keys), tuple(ignore_properties))
+        if plan_key not in plans:
+            if len(plans) >= MAX_PROPERTIES_PLANS:
+                plans.clear()
+            plans[plan_key] = self.compile_properties_plan(
+                process_properties, keys, ignore_properties
+            )
+        return plans[plan_key]
+
+    def compile_properties_plan(self, process_properties, keys, ignore_properties=[]):
+        convert_timezone = self.get_convert_timezones()
+        # Track the fields earlier steps add so later schema properties still see them.
+        present = set(keys)
+        plan = []
         for property_name, property_setting in process_properties.items():
-            if property_name in properties_data and property_name not in ignore_properties:
-                new_value = self.format_property_value(property_setting=property_setting, value=properties_data.get(property_name))
-                if property_name.find("_id") != -1:
-                    properties_data[property_name.replace("_id","")] = new_value
-                if len(convert_timezone) > 0 and property_setting.get("type") == "datetime" and properties_data.get(property_name):
-                    for suffix, timezone_name in convert_timezone.items():
-                        field_name_with_suffix = "{proterty_name}_{suffix}".format(proterty_name=property_name, suffix=suffix)
-                        if properties_data.get(property_name, "").find(".") != -1:
-                            properties_data[field_name_with_suffix] = datetime.strptime(properties_data.get(property_name), "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=utc).astimezone(timezone(timezone_name)).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
-                        else:
-                            properties_data[field_name_with_suffix] = datetime.strptime(properties_data.get(property_name), "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=utc).astimezone(timezone(timezone_name)).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
-                            new_value = datetime.strptime(properties_data.get(property_name), "%Y-%m-%dT%H:%M:%SZ").strftime("%Y-%m-%dT%H:%M:%S.%fZ")
-                properties_data[property_name] = new_value
-        return properties_data
+            if property_name not in present or property_name in ignore_properties:
+                continue
+            id_alias = property_name.replace("_id", "") if property_name.find("_id") != -1 else None
+            timezones = convert_timezone if property_setting.get("type") == "datetime" else []
+            plan.append(
+                (
+                    property_name,
+                    self.compile_property_step(
+                        property_name,
+                        self.compile_property_formatter(property_setting),
+                        id_alias,
+                        timezones,
+                    ),
+                )
+            )
+            if id_alias is not None:
+                present.add(id_alias)
+            present.update(f"{property_name}_{suffix}" for suffix, _ in timezones)
+        return plan
+
+    def compile_property_formatter(self, property_setting):
+        if type(self).format_property_value is not HubspotAgency.format_property_value:
+            return lambda value: self.format_property_value(property_setting=property_setting, value=value)
+        options_mapping = property_setting.get("options_mapping", {})
+        has_options = len(property_setting.get("options", [])) > 0
+        if property_setting.get("field_type") == "checkbox" and has_options:
+            return lambda value: value if value is None else ";".join(
+                [options_mapping.get(one, one) for one in value.split(";")]
+            )
+        elif property_setting.get("type") == "enumeration" and has_options:
+            return lambda value: value if value is None else options_mapping.get(value, value)
+        elif property_setting.get("type") == "number" and property_setting.get("referenced_object_type") == "COMPANY":
+            return lambda value: self.format_property_value(property_setting=property_setting, value=value)
+        elif property_setting.get("type") == "number":
+            return lambda value: float(value) if value else value
+        elif property_setting.get("type") == "enumeration" and property_setting.get("referenced_object_type") == "OWNER":
+            return lambda value: value if value is None else self.get_hubspot_user_name_by_id(value)
+        return lambda value: value
+
+    def compile_property_step(self, property_name, format_value, id_alias, timezones):
+        def process_property(properties_data):
+            value = properties_data.get(property_name)
+            new_value = format_value(value)
+            if id_alias is not None:
+                properties_data[id_alias] = new_value
+            if len(timezones) > 0 and value:
+                with self.metrics.timer("convert_timezone"):
+                    normalized_value, converted_values = self.convert_datetime(value, timezones)
+                    for suffix, converted_value in converted_values:
+                        properties_data[f"{property_name}_{suffix}"] = converted_value
+                    if normalized_value is not None:
+                        new_value = normalized_value
+            properties_data[property_name] = new_value
+
+        return process_property
+
+    def get_convert_timezones(self):
+        return [
+            (suffix, get_timezone(timezone_name))
+            for suffix, timezone_name in self.setting.get("convert_timezone_settings", {}).items()
+        ]
+
+    def convert_datetime(self, value, timezones):
+        # Timestamps repeat a lot within a page, so each distinct value is converted once.
+        converted = self.converted_datetimes.get(value)
+        if converted is None:
+            if len(self.converted_datetimes) >= MAX_CONVERTED_DATETIMES:
+                self.converted_datetimes.clear()
+            converted = self.converted_datetimes[value] = convert_datetime(value, timezones)
+        return converted
+
+    def convert_datetimes_page(self, object_type, raw_entities, properties=None):
+        timezones = self.get_convert_timezones()
+        if len(timezones) == 0:
+            return
+        datetime_properties = [
+            property_name
+            for property_name, property_setting in self.get_properties_can_be_processed(object_type, properties).items()
+            if property_setting.get("type") == "datetime"
+        ]
+        values = set(
+            raw_entity[property_name]
+            for raw_entity in raw_entities
+            for property_name in datetime_properties
+            if isinstance(raw_entity.get(property_name), str) and raw_entity[property_name]
+        )
+        with self.metrics.timer("convert_timezone_page"):
+            for value in values:
+                try:
+                    self.convert_datetime(value, timezones)
+                except ValueError:
+                    # Left to the per-record step, which raises it for the record as before.
+                    pass
 
     def get_hs_type(self, tx_type):
         hs_types = self.setting.get("hs_types", {})
@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import cProfile, functools, io, pstats, threading, time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+def percentile(values, pct):
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    return values[min(int(round(pct / 100.0 * (len(values) - 1))), len(values) - 1)]
+
+
+class Metrics(object):
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.timings = defaultdict(list)
+            self.counters = defaultdict(int)
+            self.started_at = time.perf_counter()
+
+    @contextmanager
+    def timer(self, name):
+        if not self.enabled:
+            yield
+            return
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started_at
+            with self.lock:
+                self.timings[name].append(elapsed)
+
+    def increment(self, name, count=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] += count
+
+    def summary(self, records_counter="records"):
+        with self.lock:
+            elapsed = time.perf_counter() - self.started_at
+            records = self.counters.get(records_counter, 0)
+            return {
+                "elapsed": round(elapsed, 3),
+                "records": records,
+                "records_per_second": round(records / elapsed, 2) if elapsed > 0 else None,
+                "timings": {
+                    name: {
+                        "count": len(values),
+                        "total": round(sum(values), 3),
+                        "p50_ms": round(percentile(values, 50) * 1000, 2),
+                        "p95_ms": round(percentile(values, 95) * 1000, 2),
+                    }
+                    for name, values in self.timings.items()
+                },
+                "counters": dict(self.counters),
+            }
+
+
+def timed(name):
+    def decorator(funct):
+        @functools.wraps(funct)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.timer(name):
+                return funct(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def profile(logger, profiler=None):
+    if not profiler:
+        yield
+        return
+    if profiler == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            logger.warning("pyinstrument is not installed, fall back to cProfile.")
+        else:
+            instrument = Profiler()
+            instrument.start()
+            try:
+                yield
+            finally:
+                instrument.stop()
+                logger.info(instrument.output_text())
+            return
+    instrument = cProfile.Profile()
+    instrument.enable()
+    try:
+        yield
+    finally:
+        instrument.disable()
+        output = io.StringIO()
+        pstats.Stats(instrument, stream=output).sort_stats("cumulative").print_stats(30)
+        logger.info(output.getvalue())
@@ -0,0 +1,112 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import threading, time, traceback, unicodedata
+
+
+def normalize_name(name):
+    if not isinstance(name, str):
+        return ""
+    name = "".join(
+        char
+        for char in unicodedata.normalize("NFKD", name)
+        if not unicodedata.combining(char)
+    )
+    # "Last, First" is looked up as "First Last".
+    if name.count(",") == 1:
+        last_name, first_name = name.split(",")
+        name = f"{first_name} {last_name}"
+    return " ".join(name.casefold().split())
+
+
+def get_display_name(owner):
+    display_name = "{first_name} {last_name}".format(
+        first_name=owner.first_name, last_name=owner.last_name
+    )
+    if owner.archived:
+        return f"{display_name} (Deactivated User)"
+    return display_name
+
+
+class OwnerIndex(object):
+    def __init__(self, logger, loader, ttl=3600):
+        self.logger = logger
+        self.loader = loader
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.refreshing = False
+        self.loaded_at = None
+        self.index = ({}, {}, {}, {})
+
+    def build(self, owners):
+        owners_by_id, names, emails, display_names = {}, {}, {}, {}
+        # Active owners win when two owners share a name.
+        for owner_id, owner in sorted(owners.items(), key=lambda item: bool(item[1].archived)):
+            owners_by_id[str(owner_id)] = owner
+            display_names[str(owner_id)] = get_display_name(owner)
+            first_name, last_name = normalize_name(owner.first_name), normalize_name(owner.last_name)
+            for key in [f"{first_name} {last_name}".strip(), f"{last_name} {first_name}".strip()]:
+                if key:
+                    names.setdefault(key, owner)
+            if getattr(owner, "email", None):
+                emails.setdefault(owner.email.casefold(), owner)
+        return owners_by_id, names, emails, display_names
+
+    def refresh(self, reload=False):
+        try:
+            index = self.build(self.loader(reload=reload))
+            with self.lock:
+                self.index = index
+                self.loaded_at = time.time()
+        except Exception:
+            self.logger.exception(f"Failed to refresh HubSpot owners: {traceback.format_exc()}")
+            if self.loaded_at is None:
+                raise
+        finally:
+            with self.lock:
+                self.refreshing = False
+
+    def get_index(self):
+        if self.loaded_at is None:
+            self.refresh()
+            return self.index
+        with self.lock:
+            expired = bool(self.ttl) and time.time() - self.loaded_at > self.ttl and not self.refreshing
+            if expired:
+                self.refreshing = True
+        if expired:
+            # Serve the current index while a background thread reloads the owners from HubSpot.
+            threading.Thread(target=self.refresh, kwargs={"reload": True}, daemon=True).start()
+        return self.index
+
+    def invalidate(self):
+        with self.lock:
+            self.index = ({}, {}, {}, {})
+            self.loaded_at = None
+
+    def get_owners(self):
+        return self.get_index()[0]
+
+    def get_names(self):
+        return self.get_index()[1]
+
+    def get_owner(self, value):
+        return self.resolve([value]).get(value)
+
+    def get_display_name(self, owner_id):
+        return self.get_index()[3].get(str(owner_id))
+
+    def resolve(self, values):
+        _, names, emails, _ = self.get_index()
+        owners = {}
+        for value in values:
+            if not isinstance(value, str) or value in owners:
+                continue
+            if "@" in value:
+                owners[value] = emails.get(value.strip().casefold())
+            else:
+                owners[value] = names.get(normalize_name(value))
+        return owners
@@ -0,0 +1,153 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import threading, time
+from concurrent.futures import ThreadPoolExecutor
+from .metrics import Metrics
+
+DAILY_RESERVATION = 50
+
+
+class TokenBucket(object):
+    def __init__(self, capacity=100, period=10, daily_limit=None, daily_counter=None):
+        self.capacity = float(capacity)
+        self.rate = float(capacity) / float(period)
+        self.tokens = float(capacity)
+        self.daily_limit = daily_limit
+        self.daily_counter = daily_counter
+        self.daily_count = 0
+        self.daily_allowance = 0
+        self.daily_lock = threading.Lock()
+        self.day = int(time.time() // 86400)
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated_at) * self.rate
+                )
+                self.updated_at = now
+                wait = self.blocked_until - now
+                if wait <= 0 and self.tokens >= 1:
+                    self.tokens -= 1
+                    break
+                if wait <= 0:
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+        self.count_daily()
+
+    def count_daily(self):
+        if self.daily_limit is None:
+            return
+        with self.daily_lock:
+            day = int(time.time() // 86400)
+            if day != self.day:
+                self.day, self.daily_count, self.daily_allowance = day, 0, 0
+            if self.daily_count >= self.daily_allowance:
+                self.daily_allowance += self.reserve_daily(day)
+            if self.daily_count >= self.daily_allowance:
+                raise Exception(f"Daily HubSpot API limit ({self.daily_limit}) is reached.")
+            self.daily_count += 1
+
+    def reserve_daily(self, day):
+        if self.daily_counter is None:
+            return self.daily_limit - self.daily_allowance
+        # Calls are reserved from the shared counter in blocks, so it is written once per block.
+        reserved = self.daily_counter(day, DAILY_RESERVATION)
+        return max(0, min(DAILY_RESERVATION, self.daily_limit - (reserved - DAILY_RESERVATION)))
+
+    def backoff(self, seconds):
+        with self.lock:
+            self.tokens = 0
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class ThrottledConnector(object):
+    def __init__(self, logger, connector, token_bucket=None, max_retries=3, metrics=None):
+        self.logger = logger
+        self.connector = connector
+        self.token_bucket = token_bucket
+        self.max_retries = max_retries
+        self.metrics = metrics if metrics is not None else Metrics()
+
+    def __getattr__(self, name):
+        attr = getattr(self.connector, name)
+        if not callable(attr):
+            return attr
+        return lambda *args, **kwargs: self.call(attr, *args, **kwargs)
+
+    def call(self, funct, *args, **kwargs):
+        return self.call_with_retries(funct, *args, **kwargs)[0]
+
+    def call_with_retries(self, funct, *args, **kwargs):
+        # Returns the result with the number of 429 retries it took.
+        name = f"hubspot.{getattr(funct, '__name__', 'call')}"
+        attempt = 0
+        while True:
+            if self.token_bucket is not None:
+                with self.metrics.timer("hubspot.throttle_wait"):
+                    self.token_bucket.acquire()
+            try:
+                with self.metrics.timer(name):
+                    return funct(*args, **kwargs), attempt
+            except Exception as e:
+                if getattr(e, "status", None) != 429 or attempt >= self.max_retries:
+                    self.metrics.increment(f"{name}.errors")
+                    raise
+                if is_daily_limit_reached(e):
+                    self.metrics.increment(f"{name}.errors")
+                    raise Exception(f"Daily HubSpot API limit is reached: {e}")
+                attempt += 1
+                self.metrics.increment("hubspot.retries")
+                delay = get_retry_after(e, attempt)
+                self.logger.warning(
+                    f"HubSpot rate limit is hit on {getattr(funct, '__name__', funct)}, retry {attempt} in {delay}s."
+                )
+                if self.token_bucket is not None:
+                    self.token_bucket.backoff(delay)
+                else:
+                    time.sleep(delay)
+
+
+class AdaptivePageSize(object):
+    def __init__(self, maximum=100, minimum=10, target_latency=2.0):
+        self.maximum = max(int(maximum), 1)
+        self.minimum = min(int(minimum), self.maximum)
+        self.target_latency = float(target_latency)
+        self.size = self.maximum
+        self.lock = threading.Lock()
+
+    def observe(self, elapsed, throttled=False):
+        with self.lock:
+            if throttled or elapsed > self.target_latency:
+                self.size = max(self.minimum, self.size // 2)
+            elif elapsed < self.target_latency / 2:
+                self.size = min(self.maximum, self.size + max(self.size // 2, 1))
+            return self.size
+
+
+def is_daily_limit_reached(exception):
+    headers = getattr(exception, "headers", None) or {}
+    return str(headers.get("X-HubSpot-RateLimit-Daily-Remaining")) == "0"
+
+
+def get_retry_after(exception, attempt):
+    headers = getattr(exception, "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return min(2**attempt, 10)
+
+
+def map_in_order(funct, items, max_workers=1):
+    if max_workers <= 1 or len(items) <= 1:
+        return [funct(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(funct, items))
@@ -0,0 +1,34 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import os, sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+import fake_hubspot
+from run_benchmarks import get_agent
+
+
+@pytest.fixture
+def lower_search_result_limit(monkeypatch):
+    # Lower the 10k search cap on both sides so a window restart takes a few thousand records.
+    from datawald_hubspotagency import hubspotagency
+
+    monkeypatch.setattr(hubspotagency, "SEARCH_RESULT_LIMIT", 1000)
+    monkeypatch.setattr(fake_hubspot, "SEARCH_RESULT_LIMIT", 1000)
+    return 1000
+
+
+@pytest.fixture
+def fake():
+    return fake_hubspot.FakeHubspot(records=3500, properties=5)
+
+
+@pytest.fixture
+def agent(fake):
+    return get_agent(fake, stream_batch_size=500)
@@ -0,0 +1,68 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+from types import SimpleNamespace
+
+
+def get_entities(tx_type, id_values):
+    return [
+        {"tx_type_src_id": f"{tx_type}-{id_value}", "data": {"external_id": id_value, "name": id_value}}
+        for id_value in id_values
+    ]
+
+
+def fail_first(batch_funct, get_error_id):
+    # Drop the first result and report it under errors[].context.ids, like a partial HubSpot batch.
+    def call(**kwargs):
+        response = batch_funct(**kwargs)
+        inputs = list(kwargs.values())[0]["inputs"]
+        response.results = response.results[1:]
+        response.errors = [SimpleNamespace(message="boom", context={"ids": [get_error_id(inputs[0])]})]
+        return response
+
+    return call
+
+
+def test_batch_upsert_maps_errors_by_id_value(fake, agent):
+    batch_api = fake.hubspot.crm.contacts.batch_api
+    batch_api.upsert = fail_first(batch_api.upsert, lambda item: item["id"])
+    contacts = get_entities("contact", ["new-1", "new-2", "new-3"])
+
+    agent.batch_upsert_objects("contact", "external_id", contacts)
+
+    assert (contacts[0]["tx_status"], contacts[0]["tx_note"], contacts[0]["tgt_id"]) == ("F", "boom", "####")
+    assert [contact["tx_status"] for contact in contacts[1:]] == ["S", "S"]
+
+
+def test_batch_create_update_maps_errors_by_hubspot_id(fake, agent):
+    batch_api = fake.hubspot.crm.products.batch_api
+    # Create errors name the id property value, update errors name the HubSpot object ID.
+    batch_api.create = fail_first(batch_api.create, lambda item: item["properties"]["external_id"])
+    batch_api.update = fail_first(batch_api.update, lambda item: item["id"])
+    products = get_entities("product", ["product-1", "product-2", "new-1", "new-2"])
+
+    agent.batch_create_update_objects("product", "external_id", products)
+
+    assert [product["tx_status"] for product in products] == ["F", "S", "F", "S"]
+    assert [product.get("tx_note") for product in products] == ["boom", None, "boom", None]
+    assert products[1]["tgt_id"] == "3"
+
+
+def test_batch_falls_back_to_per_record_calls(fake):
+    from run_benchmarks import get_agent
+
+    agent = get_agent(fake, batch_upsert=True, batch_size=2)
+
+    def upsert(**kwargs):
+        raise Exception("batch is down")
+
+    fake.hubspot.crm.contacts.batch_api.upsert = upsert
+    contacts = get_entities("contact", ["new-1", "new-2", "new-3"])
+
+    agent.batch_insert_update_persons(contacts)
+
+    assert [contact["tx_status"] for contact in contacts] == ["S", "S", "S"]
+    assert fake.calls["contact.upsert"] == 3
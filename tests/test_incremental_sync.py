@@ -0,0 +1,42 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+from run_benchmarks import get_agent
+
+PARAMS = {"target": "datawald", "tx_type": "company", "cut_date": "2023-12-31"}
+
+
+def sync(agent, **params):
+    entities = [
+        entity
+        for entities, _ in agent.tx_entities_src_stream(**params)
+        for entity in agent.filter_synced_entities(entities, **params)
+    ]
+    agent.save_high_water_mark(**params)
+    return entities
+
+
+def test_overlap_window_skips_synced_keys(fake):
+    agent = get_agent(fake, incremental_sync={"overlap_seconds": 60})
+    assert len(sync(agent, **PARAMS)) == 3500
+
+    params = agent.apply_high_water_mark(**PARAMS)
+    # The overlap window reaches back 60 seconds, three records per second, and all of them are synced already.
+    assert len([entity for entities, _ in agent.tx_entities_src_stream(**params) for entity in entities]) > 150
+    assert sync(agent, **params) == []
+
+    fake.objects["company"][3450]["lastmodifieddate"] = "2024-01-01T00:20:00Z"
+    params = agent.apply_high_water_mark(**PARAMS)
+    assert [entity["src_id"] for entity in sync(agent, **params)] == ["3451"]
+
+
+def test_full_sync_keeps_synced_keys(fake):
+    agent = get_agent(fake, incremental_sync=True)
+    sync(agent, **PARAMS)
+
+    params = agent.apply_high_water_mark(**PARAMS)
+    entities = [entity for entities, _ in agent.tx_entities_src_stream(**params) for entity in entities]
+    assert agent.filter_synced_entities(entities, full_sync=True, **params) == entities
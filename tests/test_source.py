@@ -0,0 +1,49 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+PARAMS = {"target": "datawald", "tx_type": "company", "cut_date": "2023-12-31"}
+
+
+def test_search_window_restarts_at_result_limit(lower_search_result_limit, fake, agent):
+    ids, cursors = [], []
+    for raw_entities, cursor in agent.get_raw_entities_pages("company", limit=200, **PARAMS):
+        ids.extend(raw_entity["hs_object_id"] for raw_entity in raw_entities)
+        cursors.append(cursor)
+
+    assert ids == [str(i + 1) for i in range(3500)]
+    assert len([cursor for cursor in cursors if cursor is not None and cursor["after"] is None]) >= 3
+    assert cursors[-1] is None
+
+
+def test_stream_resumes_from_checkpoint(lower_search_result_limit, fake, agent):
+    ids = []
+    for i, (entities, after) in enumerate(agent.tx_entities_src_stream(**PARAMS)):
+        ids.extend(entity["src_id"] for entity in entities)
+        agent.save_checkpoint(after, **PARAMS)
+        # Stop past the first window restart, as if the invocation timed out.
+        if i == 2:
+            break
+    assert agent.get_checkpoint(**PARAMS)["window_start"] is not None
+
+    fake.calls.clear()
+    resumed_ids = [
+        entity["src_id"]
+        for entities, _ in agent.tx_entities_src_stream(**PARAMS)
+        for entity in entities
+    ]
+
+    assert resumed_ids[0] == str(len(ids) + 1)
+    assert ids + resumed_ids == [str(i + 1) for i in range(3500)]
+    # The resumed run reads only the remaining pages, not the whole window again.
+    assert fake.calls["company.search"] < 3500 // 200
+
+
+def test_checkpoint_is_ignored_for_another_cut_date(agent):
+    agent.save_checkpoint({"window_start": 1704067300000, "after": "200", "seen": []}, **PARAMS)
+
+    assert agent.get_checkpoint(**dict(PARAMS, cut_date="2024-01-01")) is None
+    agent.save_checkpoint(None, **PARAMS)
+    assert agent.get_checkpoint(**PARAMS) is None